@@ -1,79 +1,367 @@
 import streamlit as st
 import os
-from groq import Groq
+from groq import AsyncGroq
+import httpx
+import asyncio
+import threading
 from dotenv import load_dotenv
-import time # To add a small delay for user experience
+import hashlib
+import json
+from collections import OrderedDict, deque
+import math
+import statistics
+import time
+import groq._base_client
+
+try:
+    import orjson # Optional: faster JSON encoding of request bodies
+except ImportError:
+    orjson = None
 
 # --- Configuration ---
 load_dotenv()  # Load environment variables from .env file
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
-DEFAULT_MODEL = "llama3-8b-8192" # Or choose another model like "mixtral-8x7b-32768"
+SPEED_MAP = {
+    "instant": "llama-3.1-8b-instant", # Lowest latency, good for short conversational turns
+    "balanced": "llama-3.3-70b-versatile", # Higher quality, slower
+    "fast70b": "llama-3.3-70b-specdec", # 70B quality with speculative decoding
+}
+DEFAULT_SPEED_TIER = "balanced"
+DEFAULT_MODEL = SPEED_MAP[DEFAULT_SPEED_TIER]
+SHORT_PROMPT_CHARS = 200 # Prompts shorter than this are always routed to the instant tier
+DEFAULT_MAX_TOKENS = 512 # Chat answers rarely need more; caps worst-case latency
+STOP_SEQUENCES = ["\n\nUser:", "\n\nParent:"] # Stop the model from writing fake follow-up turns
+RESPONSE_CACHE_SIZE = 512 # Max cached responses in deterministic mode
+HISTORY_WINDOW_TURNS = 6 # User/assistant pairs sent to the API alongside the system prompt
+MAX_CONCURRENT_REQUESTS = 20 # Groq calls allowed in flight at once across all sessions
+LATENCY_WINDOW = 100 # Recent API turns kept for the latency panel
+
+# Form options (tuples built once at import rather than on every rerun)
+AGE_OPTIONS = (
+    "Not specified", "Newborn (0-3 months)", "Infant (3-12 months)",
+    "Toddler (1-3 years)", "Preschooler (3-5 years)",
+    "School-Age (6-12 years)", "Teenager (13+ years)",
+)
+TEMPERAMENT_OPTIONS = (
+    "Easygoing / Adaptable", "Active / Energetic", "Shy / Cautious",
+    "Intense / Sensitive", "Distractible", "Persistent / Strong-willed",
+)
 
 # --- Helper Functions ---
-def initialize_groq_client():
-    """Initializes and returns the Groq client if the API key is valid."""
+@st.cache_resource
+def get_event_loop():
+    """Starts a background asyncio event loop in a daemon thread, shared by all sessions."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="groq-event-loop", daemon=True).start()
+    return loop
+
+@st.cache_resource
+def get_request_semaphore():
+    """Returns the process-wide semaphore bounding concurrent Groq calls on the background loop."""
+    return asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+def _use_orjson_for_request_bodies():
+    """Swaps the Groq SDK's request-body encoder for orjson, falling back to the SDK's for unsupported types."""
+    # The SDK serializes bodies through this module-level function; older SDK versions hand dicts to httpx instead
+    if orjson is None or not hasattr(groq._base_client, "openapi_dumps"):
+        return
+    sdk_dumps = groq._base_client.openapi_dumps
+
+    def dumps(obj):
+        try:
+            return orjson.dumps(obj) # Same compact, UTF-8 output as the SDK encoder
+        except TypeError: # orjson.JSONEncodeError, e.g. for pydantic models
+            return sdk_dumps(obj)
+
+    groq._base_client.openapi_dumps = dumps
+
+def _get_api_key():
+    """Returns the Groq API key, or None if it isn't configured."""
     # Prioritize environment variables, then Streamlit secrets
     api_key = os.environ.get("GROQ_API_KEY")
-    if not api_key and "GROQ_API_KEY" in st.secrets:
-        api_key = st.secrets["GROQ_API_KEY"]
-
+    if not api_key:
+        try:
+            api_key = st.secrets["GROQ_API_KEY"]
+        except (KeyError, FileNotFoundError): # No such secret, or no secrets.toml at all
+            api_key = None
+    return api_key
+
+@st.cache_resource
+def get_groq_client():
+    """Returns a process-wide async Groq client, created once and reused across reruns and sessions.
+
+    The client must only be awaited on the loop from get_event_loop().
+    """
+    api_key = _get_api_key()
     if not api_key:
         st.error("Groq API key not found. Please set GROQ_API_KEY in your environment variables or Streamlit secrets.")
         st.stop() # Halt execution if no key
 
+    # Keep-alive pool with HTTP/2 so concurrent sessions reuse warm connections
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50, keepalive_expiry=30.0),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    )
+    _use_orjson_for_request_bodies() # Runs once per process along with client creation
+    # No connection probe here: errors surface on the first real completion call
+    return AsyncGroq(api_key=api_key, http_client=http_client)
+
+async def _warm_connection(client):
+    """Makes one cheap request so DNS, TLS and the HTTP/2 connection are set up before the first chat turn."""
     try:
-        client = Groq(api_key=api_key)
-        # Test connection (optional, but good practice)
-        client.models.list()
-        return client
-    except Exception as e:
-        st.error(f"Failed to initialize or connect with Groq client: {e}")
-        st.stop()
-
-def get_groq_response(client, messages, model=DEFAULT_MODEL):
-    """Gets a response from the Groq API."""
+        await client.models.list()
+    except Exception:
+        pass # Only a warm-up; real errors surface on the first completion call
+
+def warm_groq_connection():
+    """Starts the connection warm-up on the background loop without waiting for it."""
+    return asyncio.run_coroutine_threadsafe(_warm_connection(get_groq_client()), get_event_loop())
+
+async def _stream_completion(client, semaphore, usage, **params):
+    """Async generator yielding text deltas from a streaming chat completion.
+
+    Holds a slot of the request semaphore for the whole stream, so sessions run in parallel up to the limit.
+    Runs on the background loop thread, which has no script context, so it must not call st.cache_resource
+    functions; the semaphore is fetched on the script thread and passed in.
+    Groq reports token usage on the final chunk (x_groq.usage); its completion_tokens is stored in the
+    usage dict, which the caller reads once the stream is exhausted.
+    """
+    async with semaphore:
+        stream = await client.chat.completions.create(stream=True, **params)
+        async for chunk in stream:
+            x_groq = getattr(chunk, "x_groq", None)
+            chunk_usage = getattr(x_groq, "usage", None) or getattr(chunk, "usage", None)
+            if chunk_usage is not None:
+                usage["completion_tokens"] = chunk_usage.completion_tokens
+            if chunk.choices: # The usage-only final chunk may carry no choices
+                yield chunk.choices[0].delta.content or ""
+
+async def _anext(agen):
+    return await agen.__anext__()
+
+def _iterate_on_loop(agen, loop):
+    """Bridges an async generator running on the background loop to a plain sync generator."""
     try:
-        chat_completion = client.chat.completions.create(
-            messages=messages,
-            model=model,
-            temperature=0.7,
-            max_tokens=1500, # Increased slightly for potentially more detailed answers
-            top_p=1,
-            stop=None,
-            stream=False,
-        )
-        return chat_completion.choices[0].message.content
-    except Exception as e:
-        st.error(f"An error occurred while communicating with Groq: {e}")
-        return None
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(_anext(agen), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        # Close the stream even if the consumer stops early (e.g. a rerun interrupts st.write_stream)
+        asyncio.run_coroutine_threadsafe(agen.aclose(), loop).result()
+
+@st.cache_resource
+def get_response_cache():
+    """Returns a process-wide LRU (oldest first) of final responses for deterministic requests."""
+    # Module globals are reset on every rerun, so the cache has to live in cache_resource
+    return OrderedDict()
+
+def _msg_key(messages, model, max_tokens):
+    """Builds a compact cache key from the exact messages, model and token limit sent to the API."""
+    payload = json.dumps(messages, separators=(",", ":")).encode()
+    return f"{hashlib.blake2b(payload, digest_size=16).hexdigest()}{model}:{max_tokens}"
+
+def get_groq_response(client, messages, model=DEFAULT_MODEL, deterministic=False, max_tokens=DEFAULT_MAX_TOKENS, latency_log=None):
+    """Streams a response from the Groq API, yielding text chunks as they arrive.
+
+    In deterministic mode (temperature 0) identical requests are answered from the response cache.
+    If latency_log is given, each completed API call appends (model, ttft, total, tokens) to it, with
+    tokens taken from Groq's reported usage; cache hits are not recorded. API errors are raised to the caller, so a stream that fails
+    partway is never mistaken for a complete reply.
+    """
+    cache = get_response_cache() if deterministic else None
+    if cache is not None:
+        key = _msg_key(messages, model, max_tokens)
+        cached = cache.pop(key, None)
+        if cached is not None:
+            cache[key] = cached # Re-insert to mark as most recently used
+            yield cached
+            return
+
+    start = time.perf_counter()
+    ttft = None
+    deltas = 0 # Fallback token count if the API reports no usage
+    usage = {}
+    stream = _stream_completion(
+        client,
+        get_request_semaphore(),
+        usage,
+        messages=messages,
+        model=model,
+        temperature=0 if deterministic else 0.7,
+        max_tokens=max_tokens,
+        top_p=1,
+        stop=STOP_SEQUENCES,
+    )
+    response_parts = []
+    for delta in _iterate_on_loop(stream, get_event_loop()):
+        if delta:
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            deltas += 1
+        response_parts.append(delta)
+        yield delta
+
+    if latency_log is not None and ttft is not None:
+        tokens = usage.get("completion_tokens") or deltas # Roughly one token per delta when usage is missing
+        latency_log.append((model, ttft, time.perf_counter() - start, tokens))
+
+    # Only cache complete responses, never partial ones from a failed stream
+    if cache is not None:
+        cache[key] = "".join(response_parts)
+        if len(cache) > RESPONSE_CACHE_SIZE:
+            cache.popitem(last=False)
+
+def select_model(prompt, speed_tier):
+    """Picks the model for a turn: short prompts go to the instant tier, others follow the user's choice."""
+    if len(prompt) < SHORT_PROMPT_CHARS:
+        return SPEED_MAP["instant"]
+    return SPEED_MAP[speed_tier]
 
 # --- Function to build the System Prompt ---
+# Static parts of the prompt, built once at import
+_BASE_PROMPT = (
+    "You are a helpful, empathetic, and knowledgeable AI assistant specializing in providing personalized parenting tips and advice.\n"
+    "Your tone should be supportive, understanding, and non-judgmental.\n"
+    "Focus on practical, actionable suggestions and positive reinforcement techniques.\n"
+    "Avoid overly technical jargon unless explaining a specific concept clearly.\n"
+    "Respond concisely but thoroughly to user questions about parenting challenges and strategies.\n"
+)
+_SAFETY_PROMPT = "Always prioritize safety and well-being in your advice. If a topic seems potentially serious (e.g., medical issues, severe behavioral problems), gently suggest consulting a professional (pediatrician, therapist, etc.)."
+
+# keep prefix stable for cache: no timestamps or other per-turn content, so Groq's prompt cache can reuse it
 def create_system_prompt(child_age_range, temperament_traits, current_challenges):
-    """Creates the system prompt incorporating the child's details."""
-    prompt_lines = [
-        "You are a helpful, empathetic, and knowledgeable AI assistant specializing in providing personalized parenting tips and advice.",
-        "Your tone should be supportive, understanding, and non-judgmental.",
-        "Focus on practical, actionable suggestions and positive reinforcement techniques.",
-        "Avoid overly technical jargon unless explaining a specific concept clearly.",
-        "Respond concisely but thoroughly to user questions about parenting challenges and strategies."
-    ]
+    """Creates the system prompt incorporating the child's details.
 
+    Called once at form submission with whitespace-normalized challenges; the result is stored in
+    session state and must be byte-identical for the same inputs so Groq's prefix cache keeps hitting.
+    """
     # Add context based on form input
-    if child_age_range and child_age_range != "Not specified":
-         prompt_lines.append(f"The user is specifically asking for advice related to a child in the {child_age_range} age range. Tailor your advice significantly based on this developmental stage.")
+    tail_age = (
+        f"The user is specifically asking for advice related to a child in the {child_age_range} age range. Tailor your advice significantly based on this developmental stage.\n"
+        if child_age_range and child_age_range != "Not specified"
+        else "The user has not specified a child's age range, so provide general advice or ask for clarification if age is crucial for the specific question.\n"
+    )
+    tail_temperament = (
+        f"The child's temperament is described as: {', '.join(temperament_traits)}. Keep these traits in mind when suggesting communication styles, activities, and discipline strategies.\n"
+        if temperament_traits else ""
+    )
+    tail_challenges = (
+        f"The parent mentioned they are currently focusing on or facing challenges with: '{current_challenges}'. Try to address this area proactively if relevant to the user's questions, or use it as context for your advice.\n"
+        if current_challenges else "" # Already whitespace-normalized, so empty means nothing was entered
+    )
+
+    return _BASE_PROMPT + tail_age + tail_temperament + tail_challenges + _SAFETY_PROMPT
+
+def create_welcome_message(child_age_range, temperament_traits, current_challenges):
+    """Creates the personalized first assistant message shown when the chat starts."""
+    age_part = f" for your {child_age_range.lower()}" if child_age_range and child_age_range != "Not specified" else ""
+    temperament_part = f" (described as {', '.join(temperament_traits).lower()})" if temperament_traits else ""
+    challenges_part = f" I see you're interested in '{current_challenges}'." if current_challenges else ""
+    return f"Hello! I'm ready to help with parenting tips{age_part}{temperament_part}.{challenges_part} How can I assist you today?"
+
+def create_context_summary(child_age_range, temperament_traits, current_challenges):
+    """Creates the one-line summary of the form details shown above the chat."""
+    context_summary = f"Child Age: {child_age_range}"
+    if temperament_traits:
+        context_summary += f" | Temperament: {', '.join(temperament_traits)}"
+    if current_challenges:
+        context_summary += f" | Focus: {current_challenges[:50]}..." # Truncate long text
+    return context_summary
+
+def _percentile(values, pct):
+    """Returns the pct-th percentile of values (nearest rank), tolerating very short samples."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(len(ordered) * pct / 100) - 1)]
+
+def render_latency_panel(latency_log):
+    """Shows rolling TTFT / total latency percentiles and throughput per model in the sidebar.
+
+    Drawn on full reruns only; chat_fragment triggers one whenever a new turn has been measured.
+    """
+    with st.sidebar.expander(f"Latency (last {LATENCY_WINDOW})"):
+        if not latency_log:
+            st.caption("No responses measured yet.")
+            return
+        ttfts = [ttft for _, ttft, _, _ in latency_log]
+        totals = [total for _, _, total, _ in latency_log]
+        st.metric("TTFT p50", f"{statistics.median(ttfts) * 1000:.0f}ms")
+        st.metric("TTFT p95", f"{_percentile(ttfts, 95) * 1000:.0f}ms")
+        st.metric("Total p50", f"{statistics.median(totals) * 1000:.0f}ms")
+        st.metric("Total p95", f"{_percentile(totals, 95) * 1000:.0f}ms")
+
+        # Per-model breakdown, to compare speed tiers against each other
+        by_model = {}
+        for model, ttft, total, tokens in latency_log:
+            by_model.setdefault(model, []).append((ttft, total, tokens))
+        for model, samples in by_model.items():
+            median_ttft = statistics.median(ttft for ttft, _, _ in samples)
+            rates = [tokens / (total - ttft) for ttft, total, tokens in samples if total > ttft]
+            rate_part = f", ~{statistics.median(rates):.0f} tok/s" if rates else ""
+            st.caption(f"{model}: {len(samples)} turns, TTFT p50 {median_ttft * 1000:.0f}ms{rate_part}")
+
+# --- Chat Area ---
+@st.fragment
+def chat_fragment(client):
+    """Renders the chat history and input; reruns on its own when a message is sent."""
+    # Filled in after this run's turn so it names the model that actually answered
+    model_caption = st.empty()
+
+    # Display chat messages (the system prompt is always first, so skip it by slicing)
+    # Streamlit drops any element not re-emitted on a rerun, so history is redrawn each fragment run;
+    # markdown itself is parsed in the browser, which only re-renders messages whose content changed.
+    for message in st.session_state.messages[1:]:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+
+    # --- Handle User Input ---
+    prompt = st.chat_input("Ask for parenting advice...")
+
+    if prompt:
+        # Add user message
+        st.session_state.messages.append({"role": "user", "content": prompt})
+        with st.chat_message("user"):
+            st.markdown(prompt)
+
+        # Stream response (tokens render as they arrive)
+        # Full history stays in the UI; the API only gets the system prompt plus a recent window
+        history = st.session_state.messages[1:]
+        messages_for_api = [st.session_state.messages[0]] + history[-(2 * HISTORY_WINDOW_TURNS):]
+        model = select_model(prompt, st.session_state.speed_tier)
+        last_measurement = st.session_state.latency[-1] if st.session_state.latency else None
+        with st.chat_message("assistant"):
+            try:
+                assistant_response = st.write_stream(get_groq_response(
+                    client,
+                    messages_for_api,
+                    model=model,
+                    deterministic=st.session_state.deterministic,
+                    max_tokens=st.session_state.max_tokens,
+                    latency_log=st.session_state.latency
+                ))
+            except Exception as e:
+                st.error(f"An error occurred while communicating with Groq: {e}")
+                assistant_response = None # Don't keep a partial reply in the history
+
+        # Add assistant response
+        if assistant_response:
+            st.session_state.messages.append({"role": "assistant", "content": assistant_response})
+            st.session_state.last_model = model # Only once something has actually answered
+
+        # The latency panel lives in the sidebar, outside this fragment; redraw the app only when
+        # this turn was measured (cache hits and failures aren't), not on a timer
+        if st.session_state.latency and st.session_state.latency[-1] is not last_measurement:
+            st.rerun(scope="app")
+
+    if st.session_state.last_model:
+        model_caption.caption(f"Powered by Groq ({st.session_state.last_model} answered the last question)")
     else:
-        prompt_lines.append("The user has not specified a child's age range, so provide general advice or ask for clarification if age is crucial for the specific question.")
-
-    if temperament_traits: # If the list is not empty
-        traits_string = ", ".join(temperament_traits)
-        prompt_lines.append(f"The child's temperament is described as: {traits_string}. Keep these traits in mind when suggesting communication styles, activities, and discipline strategies.")
-
-    if current_challenges and current_challenges.strip(): # If the string is not empty or just whitespace
-        prompt_lines.append(f"The parent mentioned they are currently focusing on or facing challenges with: '{current_challenges.strip()}'. Try to address this area proactively if relevant to the user's questions, or use it as context for your advice.")
-
-    prompt_lines.append("Always prioritize safety and well-being in your advice. If a topic seems potentially serious (e.g., medical issues, severe behavioral problems), gently suggest consulting a professional (pediatrician, therapist, etc.).")
-
-    return "\n".join(prompt_lines)
+        model_caption.caption(
+            f"Powered by Groq ({SPEED_MAP['instant']} for questions under {SHORT_PROMPT_CHARS} characters, "
+            f"{SPEED_MAP[st.session_state.speed_tier]} otherwise)"
+        )
 
 # --- Streamlit App ---
 
@@ -92,8 +380,14 @@ if "form_completed" not in st.session_state:
     st.session_state.child_age = None
     st.session_state.child_temperament = [] # Initialize as empty list
     st.session_state.current_challenges = "" # Initialize as empty string
+    st.session_state.system_prompt = ""
+    st.session_state.welcome = ""
+    st.session_state.context_summary = ""
     st.session_state.messages = []
-    st.session_state.client = None
+    st.session_state.last_model = None # Model used for the most recent reply
+    st.session_state.speed_tier = DEFAULT_SPEED_TIER
+    st.session_state.max_tokens = DEFAULT_MAX_TOKENS
+    st.session_state.latency = deque(maxlen=LATENCY_WINDOW) # Kept across chat restarts
 
 # --- State Management: Show Form or Chat ---
 
@@ -105,26 +399,17 @@ if not st.session_state.form_completed:
         st.subheader("Child Information")
 
         # --- Age Range ---
-        age_options = [
-            "Not specified", "Newborn (0-3 months)", "Infant (3-12 months)",
-            "Toddler (1-3 years)", "Preschooler (3-5 years)",
-            "School-Age (6-12 years)", "Teenager (13+ years)",
-        ]
         selected_age = st.selectbox(
             "Child's age range:",
-            options=age_options,
+            options=AGE_OPTIONS,
             index=0, # Default to 'Not specified'
             key="form_age" # Add key for potential later access if needed
         )
 
         # --- Temperament ---
-        temperament_options = [
-            "Easygoing / Adaptable", "Active / Energetic", "Shy / Cautious",
-            "Intense / Sensitive", "Distractible", "Persistent / Strong-willed"
-        ]
         selected_temperaments = st.multiselect(
             "Select traits that describe your child's general temperament (optional):",
-            options=temperament_options,
+            options=TEMPERAMENT_OPTIONS,
             key="form_temperament"
         )
 
@@ -142,91 +427,74 @@ if not st.session_state.form_completed:
             # Store form data in session state
             st.session_state.child_age = selected_age
             st.session_state.child_temperament = selected_temperaments
-            st.session_state.current_challenges = challenges_input
+            # Collapse whitespace once so every use (and the prompt cache) sees the same bytes
+            st.session_state.current_challenges = " ".join(challenges_input.split())
+            st.session_state.system_prompt = create_system_prompt(
+                selected_age,
+                selected_temperaments,
+                st.session_state.current_challenges
+            )
+            # Precompute display text once; it only changes when the form is resubmitted
+            st.session_state.welcome = create_welcome_message(
+                selected_age,
+                selected_temperaments,
+                st.session_state.current_challenges
+            )
+            st.session_state.context_summary = create_context_summary(
+                selected_age,
+                selected_temperaments,
+                st.session_state.current_challenges
+            )
 
             # Mark form as completed and rerun
             st.session_state.form_completed = True
-            st.success("Thanks! Setting up your personalized chat...")
-            time.sleep(1.5) # Slightly longer pause
+            st.toast("Setting up your chat...")
+            # Open a pooled connection in the background now, so it is still within keep-alive when the
+            # first question arrives; without a key this is skipped and the chat shows the key error
+            if _get_api_key():
+                warm_groq_connection()
             st.rerun()
 
 
 # --- 2. Display Chat Interface if form IS completed ---
 else:
-    # --- Initialization (only run once after form completion) ---
-    if st.session_state.client is None:
-        with st.spinner("Connecting to the AI assistant..."):
-             st.session_state.client = initialize_groq_client()
-
-        # Initialize chat history *after* form is complete and details are known
-        if not st.session_state.messages:
-            system_prompt = create_system_prompt(
-                st.session_state.child_age,
-                st.session_state.child_temperament,
-                st.session_state.current_challenges
-            )
-            st.session_state.messages = [{"role": "system", "content": system_prompt}]
-
-            # Create a more personalized welcome message
-            welcome_message_parts = ["Hello! I'm ready to help with parenting tips"]
-            if st.session_state.child_age and st.session_state.child_age != "Not specified":
-                 welcome_message_parts.append(f"for your {st.session_state.child_age.lower()}")
-            if st.session_state.child_temperament:
-                 temperament_str = ", ".join(st.session_state.child_temperament).lower()
-                 welcome_message_parts.append(f" (described as {temperament_str})")
-            welcome_message_parts.append(".")
-            if st.session_state.current_challenges and st.session_state.current_challenges.strip():
-                 welcome_message_parts.append(f" I see you're interested in '{st.session_state.current_challenges.strip()}'.")
-            welcome_message_parts.append(" How can I assist you today?")
+    client = get_groq_client()
+
+    st.sidebar.toggle(
+        "Deterministic mode",
+        key="deterministic",
+        help="Use temperature 0 and reuse answers to identical questions for faster replies."
+    )
+    st.sidebar.selectbox(
+        "Response speed",
+        options=list(SPEED_MAP),
+        key="speed_tier",
+        help="Short questions always use the instant tier; longer ones use this setting."
+    )
+    st.sidebar.number_input(
+        "Max response tokens",
+        min_value=64,
+        max_value=4096,
+        step=64,
+        key="max_tokens",
+        help="Raise this for longer, more detailed answers (slower)."
+    )
 
-            st.session_state.messages.append({"role": "assistant", "content": " ".join(welcome_message_parts)})
+    # --- Initialization (only run once after form completion) ---
+    # Initialize chat history *after* form is complete and details are known
+    if not st.session_state.messages:
+        st.session_state.messages = [{"role": "system", "content": st.session_state.system_prompt}]
+        st.session_state.messages.append({"role": "assistant", "content": st.session_state.welcome})
 
 
     # --- Display Chat Context & History ---
     # Display the context provided by the user
-    context_summary = f"Child Age: {st.session_state.child_age}"
-    if st.session_state.child_temperament:
-        context_summary += f" | Temperament: {', '.join(st.session_state.child_temperament)}"
-    if st.session_state.current_challenges and st.session_state.current_challenges.strip():
-        context_summary += f" | Focus: {st.session_state.current_challenges.strip()[:50]}..." # Truncate long text
-
-    st.caption(f"Context: {context_summary}")
-    st.caption(f"Powered by Groq ({DEFAULT_MODEL})")
-
-
-    if st.session_state.client:
-        # Display chat messages
-        for message in st.session_state.messages:
-            if message["role"] != "system":
-                with st.chat_message(message["role"]):
-                    st.markdown(message["content"])
-
-        # --- Handle User Input ---
-        prompt = st.chat_input("Ask for parenting advice...")
-
-        if prompt:
-            # Add user message
-            st.session_state.messages.append({"role": "user", "content": prompt})
-            with st.chat_message("user"):
-                st.markdown(prompt)
-
-            # Get response
-            with st.spinner("Thinking..."):
-                messages_for_api = st.session_state.messages
-                assistant_response = get_groq_response(
-                    st.session_state.client,
-                    messages_for_api,
-                    model=DEFAULT_MODEL
-                )
+    st.caption(f"Context: {st.session_state.context_summary}")
 
-            # Add assistant response
-            if assistant_response:
-                st.session_state.messages.append({"role": "assistant", "content": assistant_response})
-                with st.chat_message("assistant"):
-                    st.markdown(assistant_response)
+    # Only the chat area reruns on new messages; the rest of the page is left alone
+    chat_fragment(client)
 
-    else:
-         st.error("Chatbot could not be initialized. Please check API key and connection.")
+    render_latency_panel(st.session_state.latency)
 
     # --- Reset Button ---
     if st.sidebar.button("Restart Chat / Edit Child Info"):
@@ -235,6 +503,9 @@ else:
          st.session_state.child_age = None
          st.session_state.child_temperament = [] # Reset list
          st.session_state.current_challenges = "" # Reset string
+         st.session_state.system_prompt = ""
+         st.session_state.welcome = ""
+         st.session_state.context_summary = ""
          st.session_state.messages = []
-         st.session_state.client = None
+         st.session_state.last_model = None
          st.rerun()
\ No newline at end of file
@@ -0,0 +1,215 @@
+import ast
+import itertools
+import os
+import time
+from types import SimpleNamespace
+
+import dotenv
+import groq
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(__file__), "..", "main.py")
+
+
+def load_from_app(*names):
+    """Executes only the named top-level definitions of main.py, so pure helpers can be unit tested
+    without running the Streamlit script."""
+    with open(APP_PATH) as f:
+        tree = ast.parse(f.read())
+    wanted = [
+        node for node in tree.body
+        if getattr(node, "name", None) in names
+        or any(getattr(target, "id", None) in names for target in getattr(node, "targets", ()))
+    ]
+    namespace = {}
+    exec(compile(ast.Module(body=wanted, type_ignores=[]), APP_PATH, "exec"), namespace)
+    return namespace
+
+
+def list_join_system_prompt(child_age_range, temperament_traits, current_challenges):
+    """The original list-and-join create_system_prompt, kept as the reference for its output format."""
+    prompt_lines = [
+        "You are a helpful, empathetic, and knowledgeable AI assistant specializing in providing personalized parenting tips and advice.",
+        "Your tone should be supportive, understanding, and non-judgmental.",
+        "Focus on practical, actionable suggestions and positive reinforcement techniques.",
+        "Avoid overly technical jargon unless explaining a specific concept clearly.",
+        "Respond concisely but thoroughly to user questions about parenting challenges and strategies."
+    ]
+    if child_age_range and child_age_range != "Not specified":
+        prompt_lines.append(f"The user is specifically asking for advice related to a child in the {child_age_range} age range. Tailor your advice significantly based on this developmental stage.")
+    else:
+        prompt_lines.append("The user has not specified a child's age range, so provide general advice or ask for clarification if age is crucial for the specific question.")
+    if temperament_traits:
+        prompt_lines.append(f"The child's temperament is described as: {', '.join(temperament_traits)}. Keep these traits in mind when suggesting communication styles, activities, and discipline strategies.")
+    if current_challenges and current_challenges.strip():
+        prompt_lines.append(f"The parent mentioned they are currently focusing on or facing challenges with: '{current_challenges.strip()}'. Try to address this area proactively if relevant to the user's questions, or use it as context for your advice.")
+    prompt_lines.append("Always prioritize safety and well-being in your advice. If a topic seems potentially serious (e.g., medical issues, severe behavioral problems), gently suggest consulting a professional (pediatrician, therapist, etc.).")
+    return "\n".join(prompt_lines)
+
+
+class FakeAsyncGroq:
+    """Stands in for groq.AsyncGroq, streaming a fixed reply and recording each create() call."""
+
+    calls = []
+    warmups = 0
+    fail_after = None # Raise after this many chunks, to simulate a stream dropping partway
+    completion_tokens = None # Usage reported on the final chunk, as Groq does in x_groq.usage
+
+    def __init__(self, **kwargs):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.models = SimpleNamespace(list=self._list_models)
+
+    async def _list_models(self):
+        FakeAsyncGroq.warmups += 1
+
+    async def _create(self, **params):
+        FakeAsyncGroq.calls.append(params)
+
+        async def stream():
+            for sent, text in enumerate(("Try ", "a bedtime ", "routine.")):
+                if sent == FakeAsyncGroq.fail_after:
+                    raise RuntimeError("connection reset")
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], x_groq=None)
+            if FakeAsyncGroq.completion_tokens is not None:
+                usage = SimpleNamespace(completion_tokens=FakeAsyncGroq.completion_tokens)
+                yield SimpleNamespace(choices=[], x_groq=SimpleNamespace(usage=usage))
+
+        return stream()
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setenv("GROQ_API_KEY", "test-key")
+    monkeypatch.setattr(groq, "AsyncGroq", FakeAsyncGroq)
+    FakeAsyncGroq.calls = []
+    FakeAsyncGroq.warmups = 0
+    FakeAsyncGroq.fail_after = None
+    FakeAsyncGroq.completion_tokens = None
+    st.cache_resource.clear() # Every test starts like a fresh process
+    at = AppTest.from_file(APP_PATH, default_timeout=10).run()
+    at.button[0].click().run() # Submit the child info form
+    return at
+
+
+def test_first_turn_after_process_start_gets_a_reply(app):
+    app.chat_input[0].set_value("How do I get my toddler to sleep?").run()
+
+    assert not app.error
+    assert len(FakeAsyncGroq.calls) == 1
+    assert app.session_state.messages[-1] == {"role": "assistant", "content": "Try a bedtime routine."}
+
+
+def test_stream_failing_partway_is_not_saved_as_a_reply(app):
+    FakeAsyncGroq.fail_after = 1
+    app.chat_input[0].set_value("How do I get my toddler to sleep?").run()
+
+    assert "connection reset" in app.error[0].value
+    assert app.session_state.messages[-1] == {"role": "user", "content": "How do I get my toddler to sleep?"}
+
+
+def test_latency_panel_records_api_turns(app):
+    app.chat_input[0].set_value("How do I get my toddler to sleep?").run()
+
+    assert len(app.session_state.latency) == 1
+    assert [metric.label for metric in app.sidebar.metric] == ["TTFT p50", "TTFT p95", "Total p50", "Total p95"]
+
+
+def test_latency_uses_reported_token_usage(app):
+    FakeAsyncGroq.completion_tokens = 7
+    app.chat_input[0].set_value("How do I get my toddler to sleep?").run()
+
+    assert app.session_state.latency[-1][3] == 7
+    assert app.session_state.messages[-1]["content"] == "Try a bedtime routine."
+
+
+def test_latency_counts_deltas_without_usage(app):
+    app.chat_input[0].set_value("How do I get my toddler to sleep?").run()
+
+    assert app.session_state.latency[-1][3] == 3
+
+
+def wait_for_warmups(count):
+    for _ in range(100): # The warm-up runs on the background loop without blocking the script
+        if FakeAsyncGroq.warmups >= count:
+            break
+        time.sleep(0.01)
+
+
+def test_each_form_submit_warms_the_connection(app):
+    wait_for_warmups(1)
+    assert FakeAsyncGroq.warmups == 1
+
+    # A second session (same process, so the client stays cached) gets its own fresh warm-up
+    other = AppTest.from_file(APP_PATH, default_timeout=10).run()
+    assert FakeAsyncGroq.warmups == 1 # Just showing the form doesn't warm anything
+    other.button[0].click().run()
+    wait_for_warmups(2)
+
+    assert FakeAsyncGroq.warmups == 2
+    assert len(FakeAsyncGroq.calls) == 0
+
+
+def test_form_is_shown_without_an_api_key(monkeypatch):
+    monkeypatch.delenv("GROQ_API_KEY", raising=False)
+    monkeypatch.setattr(dotenv, "load_dotenv", lambda *args, **kwargs: False) # Ignore a local .env
+    monkeypatch.setattr(groq, "AsyncGroq", FakeAsyncGroq)
+    st.cache_resource.clear()
+    at = AppTest.from_file(APP_PATH, default_timeout=10).run()
+
+    assert "GROQ_API_KEY" not in os.environ
+    assert not at.error
+    assert at.selectbox[0].label == "Child's age range:"
+
+
+def test_caption_names_the_model_that_answered(app):
+    assert "otherwise" in app.main.caption[-1].value # No reply yet, so the routing rule is shown
+
+    app.chat_input[0].set_value("Short question?").run()
+
+    assert FakeAsyncGroq.calls[0]["model"] == "llama-3.1-8b-instant"
+    assert "llama-3.1-8b-instant answered the last question" in app.main.caption[-1].value
+
+
+def test_caption_ignores_a_failed_turn(app):
+    FakeAsyncGroq.fail_after = 0
+    app.chat_input[0].set_value("Short question?").run()
+
+    assert app.session_state.last_model is None
+    assert "otherwise" in app.main.caption[-1].value
+
+
+@pytest.fixture
+def create_system_prompt():
+    return load_from_app("_BASE_PROMPT", "_SAFETY_PROMPT", "create_system_prompt")["create_system_prompt"]
+
+
+def test_system_prompt_matches_the_list_join_format(create_system_prompt):
+    ages = (None, "Not specified", "Toddler (1-3 years)")
+    temperaments = ([], ["Shy / Cautious"], ["Active / Energetic", "Distractible"])
+    challenges = ("", "picky eating")
+    for age, traits, challenge in itertools.product(ages, temperaments, challenges):
+        assert create_system_prompt(age, traits, challenge) == list_join_system_prompt(age, traits, challenge)
+
+
+def test_system_prompt_bytes_ignore_whitespace_differences(create_system_prompt):
+    variants = ("managing screen time", "  managing   screen time\n", "managing\tscreen\n\ntime ")
+    prompts = {
+        create_system_prompt("Toddler (1-3 years)", ["Shy / Cautious"], " ".join(text.split())).encode()
+        for text in variants
+    }
+    assert len(prompts) == 1
+
+
+def test_form_submit_normalizes_challenges_before_building_the_prompt(monkeypatch):
+    monkeypatch.setenv("GROQ_API_KEY", "test-key")
+    monkeypatch.setattr(groq, "AsyncGroq", FakeAsyncGroq)
+    prompts = set()
+    for text in ("managing screen time", "  managing   screen time\n"):
+        at = AppTest.from_file(APP_PATH, default_timeout=10).run()
+        at.text_area[0].set_value(text)
+        at.button[0].click().run()
+        prompts.add(at.session_state.system_prompt)
+    assert len(prompts) == 1
+    assert "'managing screen time'" in prompts.pop()